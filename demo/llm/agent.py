@@ -1,16 +1,28 @@
+import asyncio
 import numpy as np
 from chatopenai import ChatOpenAIFromLangChain
+from toolscheduler import ToolLoopScheduler
 
 class Agent():
-    def __init__(self, model, mcpClients, system_prompt="", context="",chat_history = []) -> None:
+    TIMEOUT_MESSAGE = "⚠️ 请求处理超时，请稍后重试"
+
+    def __init__(self, model, mcpClients, system_prompt="", context="",chat_history = [], max_tool_calls = 10, max_seconds = 60, tool_cache_ttl = 30) -> None:
         self.mcpClients = mcpClients
         self.model = model
         self.system_prompt = system_prompt
         self.context = context
         self.llm = None
-        self.max_tool_calls = 10
         self.chat_history = chat_history
+        self.scheduler = ToolLoopScheduler(max_tool_calls=max_tool_calls, max_seconds=max_seconds, cache_ttl=tool_cache_ttl)
     
+    @property
+    def max_tool_calls(self):
+        return self.scheduler.max_tool_calls
+
+    @max_tool_calls.setter
+    def max_tool_calls(self, value):
+        self.scheduler.max_tool_calls = value
+
     async def init(self):
         for mcp in self.mcpClients:
             await mcp.init()
@@ -33,39 +45,70 @@ class Agent():
         if not self.llm:
             raise Exception("Agent not initialized")
         
-        response = await self.llm.chat(prompt = prompt,history_context = self.chat_history)
-        while True:
-            for response in response:
-                if isinstance(response, dict) and "tool_calls" in response and response["tool_calls"]:
-                    tool_call_list = []
-                    for tool_call in response["tool_calls"]:
-                        mcp = next(
-                            (client for client in self.mcpClients if any(
-                                t['name'] == tool_call['function']['name'] for t in client.get_tools()
-                            )),
-                             None
-                        )
+        # 每次请求独立的调用预算和去重表，多个请求并发共用一个 Agent 时互不影响
+        run = self.scheduler.start()
+        response = await self.chatWithin(run, prompt = prompt,history_context = self.chat_history)
+        # 模型最近一次给出的文字内容，超时时作为部分答案返回
+        partial = ""
+        # 本次请求内累计的工具结果，每轮都完整带给模型；同一调用的结果只带一次
+        tool_call_list = []
+        reported = set()
+        while response is not None:
+            partial = next((m['content'] for m in response if isinstance(m, dict) and m.get('content')), partial)
+            tool_calls = [
+                tool_call
+                for message in response if isinstance(message, dict) and message.get("tool_calls")
+                for tool_call in message["tool_calls"]
+            ]
+            # 模型已给出最终答案，提前结束
+            if not tool_calls:
+                break
+
+            # 本轮全是已经调用过的工具，说明模型在原地打转
+            repeated = all(run.seen(t['function']['name'], t['function']['arguments']) for t in tool_calls)
+            if repeated or run.exhausted():
+                response = await self.chatWithin(run, prompt = prompt, tool_call_list=tool_call_list, history_context = self.chat_history, use_tools = False)
+                break
+
+            results = await asyncio.gather(*(self.callTool(run, tool_call) for tool_call in tool_calls))
+            for key, result in results:
+                if key not in reported:
+                    reported.add(key)
+                    tool_call_list.append(result)
+            response = await self.chatWithin(run, prompt = prompt, tool_call_list=tool_call_list, history_context = self.chat_history)
+
+        await self.close()
+        print(response)
+        if response is None:
+            # 超过 max_seconds 不再发起新的模型调用，返回已有的部分答案或超时提示
+            return partial or self.TIMEOUT_MESSAGE
+        if isinstance(response, list):
+            return response[0]['content']
+        return response['content']
+
+    async def chatWithin(self, run, **kwargs):
+        """在本次请求剩余的时间预算内调用模型，已超时或调用超时返回 None"""
+        if run.timedOut():
+            return None
+        try:
+            return await asyncio.wait_for(self.llm.chat(**kwargs), timeout=run.remaining())
+        except asyncio.TimeoutError:
+            return None
+
+    async def callTool(self, run, tool_call):
+        """执行单个工具调用，返回 (去重 key, 工具消息)"""
+        name = tool_call['function']['name']
+        key = ToolLoopScheduler.key(name, tool_call['function']['arguments'])
+        mcp = next(
+            (client for client in self.mcpClients if any(
+                t['name'] == name for t in client.get_tools()
+            )),
+             None
+        )
 
-                        if mcp:
-                            result = await mcp.call_tool(
-                                tool_call['function']['name'],
-                                tool_call['function']['arguments']
-                            )
-                            tool_call_list.append({
-                                "role": "tool",
-                                "content": str(result),
-                                "tool_call_id": tool_call['id']
-                            })
-                        else:
-                            tool_call_list.append({
-                                "role": "tool",
-                                "content": 'Tool not found',
-                                "tool_call_id": tool_call['id']
-                            })
-                        response = await self.llm.chat(tool_call_list=tool_call_list,history_context = self.chat_history)
-                        continue
-            await self.close()
-            print(response)
-            if isinstance(response, list):
-                return response[0]['content']
-            return response['content']
\ No newline at end of file
+        content = await run.call(mcp, name, tool_call['function']['arguments'])
+        return key, {
+            "role": "tool",
+            "content": content,
+            "tool_call_id": tool_call['id']
+        }
@@ -22,9 +22,9 @@ class ChatOpenAIFromLangChain():
             temperature=0.1)
         self.message = []
 
-    async def chat(self, prompt = None, history_context = "", tool_call_list = []):
-        # 清除上一次对话,避免调用工具带来的影响
-        self.message.clear()
+    async def chat(self, prompt = None, history_context = "", tool_call_list = [], use_tools = True):
+        # 每次调用使用新的消息列表，避免并发请求或上一次工具调用互相影响
+        message = []
 
         print("本次历史会话" + str(history_context))
         # 构建当前会话，历史会话作为聊天记录传入
@@ -46,7 +46,8 @@ class ChatOpenAIFromLangChain():
 
         # 构建调用参数——调用
         invoke_kwargs = {"input": [HumanMessage(content=full_prompt)]}
-        if self.tools:
+        # use_tools=False 时不再提供工具，强制模型直接给出最终答案
+        if self.tools and use_tools:
             invoke_kwargs["tools"] = self.getToolsDefinition()
             invoke_kwargs["tool_choice"] = "auto"
         response = await self.llm.ainvoke(**invoke_kwargs)
@@ -56,7 +57,7 @@ class ChatOpenAIFromLangChain():
             content = response.content
         if hasattr(response, "tool_calls") and response.tool_calls:
             for tool_call in response.tool_calls:
-                self.message.append({
+                message.append({
                     "role": "assistant", 
                     "content": content, 
                     "tool_calls": [
@@ -70,13 +71,14 @@ class ChatOpenAIFromLangChain():
                         }
                     ]
                 })
-        if not self.message:
-            self.message.append({
+        if not message:
+            message.append({
                     "role": "assistant", 
                     "content": content, 
                     "tool_calls": None
                 })
-        return self.message
+        self.message = message
+        return message
                 
     def getToolsDefinition(self):
         if self.tools:
@@ -1,5 +1,5 @@
 import os
-from vectorstore import VectorStore
+from vectorstore import VectorStore, DEFAULT_NAMESPACE
 from langchain_community.embeddings import DashScopeEmbeddings
 
 os.environ["DASHSCOPE_API_KEY"] = "sk-4431e38c85224bf3aee564da442729c6"
@@ -10,19 +10,34 @@ class EmbeddingRetriever:
         self.vectorStore = VectorStore()
         self.key = os.environ["DASHSCOPE_API_KEY"]
 
-    async def embedDocument(self, text):
-        doc_emb = await self.embed(text)
-        self.vectorStore.add(doc_emb, text)
+    async def embedDocument(self, text, metadata=None, namespace: str = DEFAULT_NAMESPACE, doc_id: str = None):
+        """写入文档向量；指定 doc_id 时按 id 覆盖旧版本，避免重复入库产生陈旧副本"""
+        doc_emb = (await self.embed([text]))[0]
+        if doc_id:
+            self.vectorStore.upsert(doc_id, doc_emb, text, metadata, namespace)
+        else:
+            self.vectorStore.add(doc_emb, text, metadata, namespace)
         return doc_emb
+
+    def deleteDocument(self, doc_id: str, namespace: str = DEFAULT_NAMESPACE) -> bool:
+        return self.vectorStore.delete(doc_id, namespace)
     
     async def embedQuery(self, query):
-        return await self.embed(query)
+        return (await self.embed([query]))[0]
     
-    async def embed(self, text):
+    async def embed(self, texts):
         embeddings = DashScopeEmbeddings(model=self.embeddingModel, dashscope_api_key=self.key)
-        vector = await embeddings.aembed_documents(texts=text)
-        return vector
+        vectors = await embeddings.aembed_documents(texts=texts)
+        return vectors
     
-    async def retrieve(self, query: str, topk: int = 3):
+    async def retrieve(self, query: str, topk: int = 3, filter=None, namespace: str = DEFAULT_NAMESPACE):
         query_emb = await self.embedQuery(query=query)
-        return self.vectorStore.search(query_emb, topk)
\ No newline at end of file
+        return self.vectorStore.search(query_emb, topk, filter=filter, namespace=namespace)
+
+    async def retrieve_batch(self, queries: list[str], topk: int = 3, filter=None, namespace: str = DEFAULT_NAMESPACE):
+        """批量检索：一次 embedding 调用拿到全部 query 向量，按 query 顺序逐条产出结果"""
+        if not queries:
+            return
+        query_embs = await self.embed(queries)
+        for texts in self.vectorStore.search_batch(query_embs, topk, filter=filter, namespace=namespace):
+            yield texts
\ No newline at end of file
@@ -0,0 +1,102 @@
+import json
+import time
+import asyncio
+import threading
+
+class ToolLoopScheduler:
+    """Agent 工具调用调度器：限制单次请求的调用次数和耗时，并对相同调用去重缓存
+
+    - 每次请求通过 start() 拿到独立的 ToolLoopRun，预算和去重表互不影响
+    - 同一请求内相同的 (工具名, 参数) 只真正执行一次，并发的重复调用共享同一个任务
+    - 跨请求的结果在 cache_ttl 秒内复用，缓存可被多个线程/事件循环共享
+    - 缓存命中不计入 max_tool_calls
+    """
+    def __init__(self, max_tool_calls: int = 10, max_seconds: float = 60, cache_ttl: float = 30):
+        self.max_tool_calls = max_tool_calls
+        self.max_seconds = max_seconds
+        self.cache_ttl = cache_ttl
+        # 跨请求缓存：key -> (过期时间, 结果)
+        self._cache: dict[str, tuple[float, str]] = {}
+        self._cacheLock = threading.Lock()
+
+    def start(self) -> "ToolLoopRun":
+        """开始一次新请求，返回本次请求专用的预算和去重表"""
+        now = time.monotonic()
+        with self._cacheLock:
+            self._cache = {key: entry for key, entry in self._cache.items() if entry[0] > now}
+        return ToolLoopRun(self, self.max_tool_calls, now + self.max_seconds)
+
+    def getCached(self, key: str):
+        with self._cacheLock:
+            cached = self._cache.get(key)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        return None
+
+    def putCached(self, key: str, result: str):
+        with self._cacheLock:
+            self._cache[key] = (time.monotonic() + self.cache_ttl, result)
+
+    @staticmethod
+    def key(name: str, arguments) -> str:
+        if isinstance(arguments, str):
+            try:
+                arguments = json.loads(arguments)
+            except ValueError:
+                pass
+        return name + ":" + json.dumps(arguments, sort_keys=True, ensure_ascii=False, default=str)
+
+class ToolLoopRun:
+    """单次请求的调度状态：调用计数、截止时间和进行中的调用表，只在发起请求的事件循环中使用"""
+    def __init__(self, scheduler: ToolLoopScheduler, max_tool_calls: int, deadline: float):
+        self.scheduler = scheduler
+        self.max_tool_calls = max_tool_calls
+        self.deadline = deadline
+        self.calls = 0
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    def remaining(self) -> float:
+        return max(0.0, self.deadline - time.monotonic())
+
+    def timedOut(self) -> bool:
+        return self.remaining() <= 0
+
+    def exhausted(self) -> bool:
+        return self.calls >= self.max_tool_calls or self.timedOut()
+
+    def seen(self, name: str, arguments) -> bool:
+        """本次请求中是否已经发起过相同的调用"""
+        return ToolLoopScheduler.key(name, arguments) in self._inflight
+
+    async def call(self, mcp, name: str, arguments) -> str:
+        """执行一次工具调用；mcp 为 None 表示没有客户端提供该工具"""
+        key = ToolLoopScheduler.key(name, arguments)
+        task = self._inflight.get(key)
+        if task is None:
+            cached = self.scheduler.getCached(key) if mcp else None
+            if mcp is None:
+                # 不存在的工具同样计入预算并记为已调用，避免模型反复请求时空转
+                self.calls += 1
+                task = asyncio.get_running_loop().create_future()
+                task.set_result("Tool not found")
+            elif cached is not None:
+                task = asyncio.get_running_loop().create_future()
+                task.set_result(cached)
+            elif self.exhausted():
+                return "Tool call budget exhausted"
+            else:
+                self.calls += 1
+                task = asyncio.ensure_future(self._execute(mcp, name, arguments, key))
+            self._inflight[key] = task
+        return await task
+
+    async def _execute(self, mcp, name: str, arguments, key: str) -> str:
+        try:
+            result = str(await asyncio.wait_for(mcp.call_tool(name, arguments), timeout=self.remaining()))
+        except asyncio.TimeoutError:
+            return "Tool call timed out"
+        except Exception as e:
+            # 单个工具失败不应中断整个请求，错误作为工具结果交给模型，且不写入缓存
+            return f"Tool call failed: {e}"
+        self.scheduler.putCached(key, result)
+        return result
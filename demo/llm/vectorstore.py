@@ -1,22 +1,406 @@
+import bisect
+import threading
+import uuid
+import numpy as np
+
+DEFAULT_NAMESPACE = "default"
+# 过滤条件支持的操作符：$eq 等值、$in 任一匹配、其余为范围比较
+FILTER_OPERATORS = ("$eq", "$in", "$gt", "$gte", "$lt", "$lte")
+
+def _validateFilter(filter):
+    """检查过滤条件，不合法时抛出 ValueError
+
+    filter 形如 {"source": "wiki", "year": [2023, 2024], "date": {"$gte": "2024-01-01", "$lt": "2025-01-01"}}：
+    标量取值为等值匹配，列表取值为任一匹配，字典取值为操作符表达式，多个字段之间取交集。
+    """
+    if not filter:
+        return
+    if not isinstance(filter, dict):
+        raise ValueError(f"过滤条件必须是字典: {filter!r}")
+    for field, expected in filter.items():
+        operands = []
+        if isinstance(expected, dict):
+            unknown = [op for op in expected if op not in FILTER_OPERATORS]
+            if unknown or not expected:
+                raise ValueError(f"字段 {field} 的过滤操作符不合法: {unknown or expected}，仅支持 {FILTER_OPERATORS}")
+            for op, operand in expected.items():
+                if op == "$in":
+                    if not isinstance(operand, (list, tuple, set)):
+                        raise ValueError(f"字段 {field} 的 $in 取值必须是列表: {operand!r}")
+                    operands.extend(operand)
+                else:
+                    operands.append(operand)
+        elif isinstance(expected, (list, tuple, set)):
+            operands.extend(expected)
+        else:
+            operands.append(expected)
+        for operand in operands:
+            try:
+                hash(operand)
+            except TypeError:
+                raise ValueError(f"字段 {field} 的过滤取值不可哈希: {operand!r}") from None
+
+def _orderGroup(value):
+    """范围比较按类型分组：int/float 同属数字组，其余按具体类型分组；None 不参与排序"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return "number"
+    return type(value)
+
 class VectorItem:
-    def __init__(self, embedding, text):
+    def __init__(self, embedding, text, metadata=None):
         self.embedding = embedding
         self.text = text
+        self.metadata = metadata or {}
 
-class VectorStore:
+class _Namespace:
+    """单个命名空间（租户）的分区：独立的向量矩阵和元数据倒排索引
+
+    行只追加不修改，删除/覆盖通过墓碑标记实现，由 VectorStore 的后台压缩统一清理。
+    """
     def __init__(self):
-        self.vectorStore: list[VectorItem] = []
-    
-    def add(self, embedding, text):
-        self.vectorStore.append(VectorItem(embedding,text))
-    
-    def search(self, query, topk: int = 3):
-        score_list = sorted(self.vectorStore, key= lambda x: self.cosSim(query, x.embedding), reverse=True)
-        return [item.text for item in score_list[:topk]]
-    
+        self.items: list[VectorItem] = []
+        self.ids: list[str] = []
+        # 文档 id -> 当前有效行号
+        self.idToRow: dict[str, int] = {}
+        # 已删除/被覆盖的行号
+        self.tombstones: set[int] = set()
+        # 倒排索引：字段 -> 取值 -> 行号列表（行号按写入顺序递增）
+        self.index: dict[str, dict] = {}
+        # 有序索引：字段 -> 类型分组 -> 排好序的去重取值，供范围过滤二分查找，
+        # 按类型分组保证混入其他类型的取值不会影响数字/日期等字段的范围过滤
+        self.sortedValues: dict[str, dict] = {}
+        # 归一化后的向量矩阵缓存，行数落后于 items 时增量补齐
+        self._matrix = None
+        # 并发检索可能同时补齐矩阵，补齐过程需串行化
+        self._matrixLock = threading.Lock()
+
+    def add(self, doc_id: str, item: VectorItem) -> int:
+        row = len(self.items)
+        self.items.append(item)
+        self.ids.append(doc_id)
+        self.idToRow[doc_id] = row
+        for field, value in item.metadata.items():
+            # 列表型取值（如标签）按元素分别建索引
+            for v in (value if isinstance(value, (list, tuple, set)) else [value]):
+                postings = self.index.setdefault(field, {})
+                try:
+                    if v not in postings:
+                        self._insertSorted(field, v)
+                    postings.setdefault(v, []).append(row)
+                except TypeError:
+                    # 不可哈希的取值不参与过滤
+                    pass
+        return row
+
+    def _insertSorted(self, field: str, value):
+        group = _orderGroup(value)
+        if group is None:
+            return
+        values = self.sortedValues.setdefault(field, {}).setdefault(group, [])
+        try:
+            bisect.insort(values, value)
+        except TypeError:
+            # 同类型内部也无法排序的取值（如元素类型混杂的元组），只支持等值过滤
+            pass
+
+    def tombstone(self, row: int):
+        self.tombstones.add(row)
+        doc_id = self.ids[row]
+        if self.idToRow.get(doc_id) == row:
+            del self.idToRow[doc_id]
+
+    def getMatrix(self):
+        count = len(self.items)
+        matrix = self._matrix
+        if matrix is not None and len(matrix) >= count:
+            return matrix
+        with self._matrixLock:
+            # 拿到锁后重新读取，其他检索可能已经补齐
+            matrix = self._matrix
+            start = 0 if matrix is None else len(matrix)
+            if start < count:
+                appended = VectorStore._normalize(np.asarray([item.embedding for item in self.items[start:count]], dtype=np.float32))
+                matrix = appended if matrix is None else np.vstack([matrix, appended])
+                self._matrix = matrix
+            return matrix
+
+    def candidates(self, filter):
+        """根据过滤条件在倒排索引上求候选行号，返回 None 表示不过滤，条件格式见 _validateFilter"""
+        if not filter:
+            return None
+        rows = None
+        for field, expected in filter.items():
+            matched = self._match(field, expected)
+            rows = matched if rows is None else rows & matched
+            if not rows:
+                break
+        rows -= self.tombstones
+        return np.fromiter(sorted(rows), dtype=np.intp, count=len(rows))
+
+    def _match(self, field: str, expected) -> set:
+        postings = self.index.get(field, {})
+        if not isinstance(expected, dict):
+            values = expected if isinstance(expected, (list, tuple, set)) else [expected]
+            return self._lookup(postings, values)
+
+        matched = None
+        if "$eq" in expected:
+            matched = self._lookup(postings, [expected["$eq"]])
+        if "$in" in expected:
+            found = self._lookup(postings, expected["$in"])
+            matched = found if matched is None else matched & found
+        bounds = {op: operand for op, operand in expected.items() if op not in ("$eq", "$in")}
+        if bounds:
+            found = self._lookup(postings, self._range(field, bounds))
+            matched = found if matched is None else matched & found
+        return matched
+
+    @staticmethod
+    def _lookup(postings: dict, values) -> set:
+        matched = set()
+        for v in values:
+            matched.update(postings.get(v, ()))
+        return matched
+
+    def _range(self, field: str, bounds: dict) -> list:
+        """在与条件同类型的有序索引上二分出满足全部范围条件的取值"""
+        groups = set()
+        for operand in bounds.values():
+            try:
+                operand < operand
+            except TypeError:
+                raise ValueError(f"字段 {field} 的范围条件取值不可排序: {operand!r}") from None
+            groups.add(_orderGroup(operand))
+        if None in groups:
+            raise ValueError(f"字段 {field} 的范围条件取值不可排序: {bounds!r}")
+        if len(groups) > 1:
+            # 不同类型的上下界不可能同时满足
+            return []
+        values = self.sortedValues.get(field, {}).get(groups.pop(), [])
+        low, high = 0, len(values)
+        try:
+            for op, operand in bounds.items():
+                if op == "$gt":
+                    low = max(low, bisect.bisect_right(values, operand))
+                elif op == "$gte":
+                    low = max(low, bisect.bisect_left(values, operand))
+                elif op == "$lt":
+                    high = min(high, bisect.bisect_left(values, operand))
+                else:
+                    high = min(high, bisect.bisect_right(values, operand))
+        except TypeError:
+            raise ValueError(f"字段 {field} 的范围条件无法与同类型取值比较: {bounds!r}") from None
+        return values[low:high]
+
+class VectorStore:
+    def __init__(self, compact_threshold: float = 0.3):
+        self.namespaces: dict[str, _Namespace] = {}
+        # 墓碑占比超过该阈值时触发后台压缩
+        self.compact_threshold = compact_threshold
+        # 串行化写入与压缩结果的替换；检索不加锁
+        self._lock = threading.Lock()
+        self._compacting: set[str] = set()
+
+    def add(self, embedding, text, metadata=None, namespace: str = DEFAULT_NAMESPACE, doc_id: str = None) -> str:
+        """新增一条文档并返回其 id；id 已存在时报错，覆盖请用 upsert"""
+        doc_id = doc_id or uuid.uuid4().hex
+        with self._lock:
+            partition = self.namespaces.setdefault(namespace, _Namespace())
+            if doc_id in partition.idToRow:
+                raise ValueError(f"文档 id 已存在: {doc_id}")
+            partition.add(doc_id, VectorItem(embedding, text, metadata))
+        return doc_id
+
+    def upsert(self, doc_id: str, embedding, text, metadata=None, namespace: str = DEFAULT_NAMESPACE) -> str:
+        """写入或覆盖指定 id 的文档：旧行打墓碑，新内容追加为新行"""
+        with self._lock:
+            partition = self.namespaces.setdefault(namespace, _Namespace())
+            old_row = partition.idToRow.get(doc_id)
+            if old_row is not None:
+                partition.tombstone(old_row)
+            partition.add(doc_id, VectorItem(embedding, text, metadata))
+            if old_row is not None:
+                self._maybeCompact(namespace)
+        return doc_id
+
+    def delete(self, doc_id: str, namespace: str = DEFAULT_NAMESPACE) -> bool:
+        """删除指定 id 的文档，返回是否存在该文档"""
+        with self._lock:
+            partition = self.namespaces.get(namespace)
+            row = partition.idToRow.get(doc_id) if partition else None
+            if row is None:
+                return False
+            partition.tombstone(row)
+            self._maybeCompact(namespace)
+        return True
+
+    def compact(self, namespace: str = DEFAULT_NAMESPACE) -> bool:
+        """压缩分区：丢弃墓碑行并重建矩阵和倒排索引
+
+        重建在锁外进行，期间检索继续使用旧分区；重建完成后在锁内补上
+        这段时间的新写入和删除，再整体替换分区。
+        """
+        with self._lock:
+            partition = self.namespaces.get(namespace)
+            if partition is None or not partition.tombstones:
+                return False
+            count = len(partition.items)
+            items = partition.items[:count]
+            ids = partition.ids[:count]
+            tombstones = set(partition.tombstones)
+
+        compacted = _Namespace()
+        old_to_new = {}
+        for row in range(count):
+            if row not in tombstones:
+                old_to_new[row] = compacted.add(ids[row], items[row])
+        if compacted.items:
+            compacted.getMatrix()
+
+        with self._lock:
+            if self.namespaces.get(namespace) is not partition:
+                return False
+            for row in partition.tombstones - tombstones:
+                if row < count:
+                    compacted.tombstone(old_to_new[row])
+            for row in range(count, len(partition.items)):
+                new_row = compacted.add(partition.ids[row], partition.items[row])
+                if row in partition.tombstones:
+                    compacted.tombstone(new_row)
+            self.namespaces[namespace] = compacted
+        return True
+
+    def _maybeCompact(self, namespace: str):
+        # 调用方需持有 self._lock
+        partition = self.namespaces[namespace]
+        if namespace in self._compacting or not partition.items:
+            return
+        if len(partition.tombstones) / len(partition.items) < self.compact_threshold:
+            return
+        self._compacting.add(namespace)
+        threading.Thread(target=self._compactInBackground, args=(namespace,), daemon=True).start()
+
+    def _compactInBackground(self, namespace: str):
+        try:
+            self.compact(namespace)
+        except Exception as e:
+            print(f"Warning: Error compacting namespace {namespace}: {e}")
+        finally:
+            with self._lock:
+                self._compacting.discard(namespace)
+
+    def search(self, query, topk: int = 3, filter=None, namespace: str = DEFAULT_NAMESPACE):
+        return next(self.search_batch([query], topk, filter=filter, namespace=namespace))
+
+    def search_batch(self, queries, topk: int = 3, filter=None, namespace: str = DEFAULT_NAMESPACE, batch_size: int = 256):
+        """批量检索：按 batch_size 分块做一次矩阵乘法，逐条 query 产出 topk 文本
+
+        只在 namespace 对应的分区内检索；给定 filter 时先用倒排/有序索引筛出候选行，
+        只对候选子矩阵打分，开销与过滤后的规模成正比。墓碑行不参与排序。
+        """
+        _validateFilter(filter)
+        if len(queries) == 0:
+            return
+        partition = self.namespaces.get(namespace)
+        if partition is None or not partition.items:
+            for _ in queries:
+                yield []
+            return
+
+        matrix = partition.getMatrix()
+        rows = partition.candidates(filter)
+        dead = None
+        if rows is not None:
+            # 并发写入可能让索引领先于矩阵，只保留矩阵已覆盖的行
+            rows = rows[rows < len(matrix)]
+            matrix = matrix[rows]
+        elif partition.tombstones:
+            dead = np.fromiter(set(partition.tombstones), dtype=np.intp)
+            dead = dead[dead < len(matrix)]
+        if len(matrix) == 0:
+            for _ in queries:
+                yield []
+            return
+
+        query_matrix = self._normalize(np.asarray(queries, dtype=np.float32).reshape(len(queries), -1))
+        for start in range(0, len(query_matrix), batch_size):
+            scores = query_matrix[start:start + batch_size] @ matrix.T
+            if dead is not None:
+                scores[:, dead] = -np.inf
+            for row in scores:
+                top = self._topk(row, topk)
+                if dead is not None:
+                    top = top[np.isfinite(row[top])]
+                if rows is not None:
+                    top = rows[top]
+                yield [partition.items[i].text for i in top]
+
     def cosSim(self, vec1, vec2):
         dot_product = sum(a * b for a,b in zip(vec1, vec2))
         norm_a = sum(a * a for a in vec1)
         norm_b = sum(b * b for b in vec2)
         if norm_a == 0 or norm_b == 0: return 0
-        return dot_product / (norm_a * norm_b)
\ No newline at end of file
+        return dot_product / (norm_a * norm_b)
+
+    @staticmethod
+    def _normalize(matrix):
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return matrix / norms
+
+    @staticmethod
+    def _topk(scores, topk: int):
+        if topk <= 0:
+            return np.empty(0, dtype=np.intp)
+        if topk >= len(scores):
+            return np.argsort(-scores)
+        # 先 argpartition 取出 topk 候选，再只对这 topk 个排序
+        candidates = np.argpartition(-scores, topk - 1)[:topk]
+        return candidates[np.argsort(-scores[candidates])]
+
+# 测试代码（验证并发检索、写入与后台压缩下 items / ids / 矩阵行保持对齐）
+if __name__ == "__main__":
+    import random
+    import time
+
+    dim = 8
+    store = VectorStore(compact_threshold=0.2)
+    rng = np.random.default_rng(0)
+    stop = threading.Event()
+    errors = []
+
+    def reader():
+        local_rng = np.random.default_rng()
+        while not stop.is_set():
+            try:
+                store.search(local_rng.normal(size=dim), topk=5, filter={"k": random.randint(0, 3)} if random.random() < 0.5 else None)
+            except Exception as e:
+                errors.append(e)
+
+    readers = [threading.Thread(target=reader) for _ in range(4)]
+    for t in readers:
+        t.start()
+    for _ in range(5000):
+        doc_id = str(random.randint(0, 300))
+        if random.random() < 0.3:
+            store.delete(doc_id)
+        else:
+            store.upsert(doc_id, rng.normal(size=dim), doc_id, {"k": random.randint(0, 3)})
+    time.sleep(0.5)
+    stop.set()
+    for t in readers:
+        t.join()
+
+    partition = store.namespaces[DEFAULT_NAMESPACE]
+    matrix = partition.getMatrix()
+    live = {partition.ids[row] for row in range(len(partition.items)) if row not in partition.tombstones}
+    assert not errors, errors[:3]
+    assert len(partition.items) == len(partition.ids) == len(matrix)
+    assert all(partition.items[row].text == doc_id for row, doc_id in enumerate(partition.ids))
+    assert np.allclose(matrix, VectorStore._normalize(np.asarray([item.embedding for item in partition.items], dtype=np.float32)))
+    assert live == set(partition.idToRow)
+    assert all(row not in partition.tombstones for row in partition.idToRow.values())
+    print(f"✅ 并发检索/写入/压缩校验通过：{len(partition.items)} 行，{len(partition.tombstones)} 个墓碑")
+